@@ -1,7 +1,14 @@
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+from datetime import date
 from handlers import Hotel
+import threading
 import sqlite3
+import render
+import time
 import os
+import re
+
+schema_version: int = 4
 
 
 class Request:
@@ -23,10 +30,7 @@ class Request:
         self.city = city
 
     def __str__(self) -> str:
-        hotels_names: str = '\n• '.join(map(lambda x: x.name, self.hotels))
-        return '✅ The result of the request based on the {command} command in {city} at {date}:\n• {result}'.format(
-            command=self.command, city=self.city, date=self.date, result=hotels_names
-        )
+        return render.render_request(self)
 
 
 class DataBase:
@@ -37,22 +41,47 @@ class DataBase:
         filename (str): the filename of database
     
     Attributes:
-        conn: connection to a database
-        cursor: connection cursor
+        conn: connection to a database, separate for every thread
+        cursor: connection cursor, separate for every thread
+        migrated (bool): whether the schema of the database has been checked
+        local (threading.local): storage of the connection and cursor of each thread
 
     """
     def __init__(self, filename: str) -> None:
         self.filename: str = filename
-        self.conn = None
-        self.cursor = None
+        self.local = threading.local()
+        self.migrated: bool = False
+
+    @property
+    def conn(self) -> Optional[sqlite3.Connection]:
+        return getattr(self.local, 'conn', None)
+
+    @conn.setter
+    def conn(self, conn: Optional[sqlite3.Connection]) -> None:
+        self.local.conn = conn
+
+    @property
+    def cursor(self) -> Optional[sqlite3.Cursor]:
+        return getattr(self.local, 'cursor', None)
+
+    @cursor.setter
+    def cursor(self, cursor: Optional[sqlite3.Cursor]) -> None:
+        self.local.cursor = cursor
 
     def start(self) -> None:
         """
         Method that starts the database
         :return: None
         """
-        self.conn = sqlite3.connect(self.filename)
+        # several worker processes may write the history at the same time:
+        # WAL lets readers work during a write and the timeout makes writers wait for each other
+        self.conn = sqlite3.connect(self.filename, timeout=30)
+        # lets the maintenance return the free pages of a new database to the file system
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.conn.execute("PRAGMA journal_mode=WAL")
         self.cursor = self.conn.cursor()
+        if not self.migrated:
+            self.migrate()
 
     def close(self) -> None:
         """
@@ -74,17 +103,39 @@ class DataBase:
             os.remove(self.filename)
             self.conn = sqlite3.connect(self.filename)
             self.cursor = self.conn.cursor()
-            self.create()
+            self.migrated = False
+            self.migrate()
             print('The database was successfully cleared!')
         except PermissionError:
             print('The Exception occurred! Please close the database and try again!')
 
+    def migrate(self) -> None:
+        """
+        Method that creates the missing tables if the schema of the database is older than the current one.
+        The version of the schema is kept in the database itself
+        :return: None
+        """
+        version: int = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < schema_version:
+            self.create()
+            if version < 4:
+                # linking the hotels of the requests saved before the request_hotels table
+                self.cursor.execute("SELECT requestId, hotels FROM requests")
+                self.cursor.executemany(
+                    "INSERT OR IGNORE INTO request_hotels VALUES (?, ?)",
+                    [(i_request[0], i_hotel_id) for i_request in self.cursor.fetchall()
+                     for i_hotel_id in i_request[1].split(', ')]
+                )
+            self.conn.execute("PRAGMA user_version={}".format(schema_version))
+            self.conn.commit()
+        self.migrated = True
+
     def create(self) -> None:
         """
         Method that generates all tables in database
         :return: None
         """
-        self.cursor.execute("""CREATE TABLE hotels (
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS hotels (
                 hotelId char UNIQUE NOT NULL,
                 name char NOT NULL,
                 address char NOT NULL,
@@ -93,7 +144,7 @@ class DataBase:
                 distance char NOT NULL
             )""")
         self.conn.commit()
-        self.cursor.execute("""CREATE TABLE requests (
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS requests (
                 requestId integer PRIMARY KEY AUTOINCREMENT NOT NULL,
                 userId integer NOT NULL,
                 command char NOT NULL,
@@ -101,11 +152,58 @@ class DataBase:
                 time DATE DEFAULT (DATETIME('now')) NOT NULL,
                 hotels text NOT NULL
             )""")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS requests_user ON requests (userId)")
+        self.conn.commit()
+        # append-only observations of prices, clustered by hotel and dates for range queries
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS prices (
+                hotelId char NOT NULL,
+                checkIn DATE NOT NULL,
+                checkOut DATE NOT NULL,
+                observedAt integer NOT NULL,
+                price real NOT NULL,
+                PRIMARY KEY (hotelId, checkIn, checkOut, observedAt)
+            ) WITHOUT ROWID""")
+        self.conn.commit()
+        # daily rollups of the observations
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS price_rollups (
+                hotelId char NOT NULL,
+                checkIn DATE NOT NULL,
+                checkOut DATE NOT NULL,
+                day DATE NOT NULL,
+                minPrice real NOT NULL,
+                maxPrice real NOT NULL,
+                total real NOT NULL,
+                count integer NOT NULL,
+                PRIMARY KEY (hotelId, checkIn, checkOut, day)
+            ) WITHOUT ROWID""")
+        self.conn.commit()
+        # counters of the changes the cached messages depend on
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS versions (
+                name char PRIMARY KEY NOT NULL,
+                value integer NOT NULL
+            )""")
+        self.cursor.execute("INSERT OR IGNORE INTO versions VALUES ('hotel_names', 0)")
+        self.cursor.execute("""CREATE TRIGGER IF NOT EXISTS hotels_renamed AFTER UPDATE OF name ON hotels
+            WHEN old.name IS NOT new.name BEGIN
+                UPDATE versions SET value=value + 1 WHERE name='hotel_names';
+            END""")
+        self.conn.commit()
+        # hotels of every request, indexed by hotel to find the hotels no request refers to
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS request_hotels (
+                requestId integer NOT NULL,
+                hotelId char NOT NULL,
+                PRIMARY KEY (requestId, hotelId)
+            ) WITHOUT ROWID""")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS request_hotels_hotel ON request_hotels (hotelId)")
+        self.cursor.execute("""CREATE TRIGGER IF NOT EXISTS requests_deleted AFTER DELETE ON requests BEGIN
+                DELETE FROM request_hotels WHERE requestId=old.requestId;
+            END""")
         self.conn.commit()
 
     def insert_hotel(self, hotel: Hotel) -> None:
         """
-        Method that inserts the hotel to the database
+        Method that inserts the hotel to the database or updates it if it is already there.
+        The caller commits the change
 
         :param hotel: the instance of the hotel class that needs to be inserted
         :type hotel: Hotel
@@ -113,14 +211,125 @@ class DataBase:
         """
         try:
             self.cursor.execute(
-                "INSERT INTO hotels VALUES (:hotelId, :name, :address, :price, :rating, :distance)",
+                "INSERT INTO hotels VALUES (:hotelId, :name, :address, :price, :rating, :distance) "
+                "ON CONFLICT (hotelId) DO UPDATE SET name=excluded.name, address=excluded.address, "
+                "price=excluded.price, rating=excluded.rating, distance=excluded.distance",
                 {'hotelId': hotel.id, 'name': hotel.name, 'address': hotel.address, 'price': hotel.price,
                  'rating': hotel.rating, 'distance': hotel.distance}
             )
         except sqlite3.IntegrityError:
+            # the API did not return some of the hotel's details
             pass
-        finally:
-            self.conn.commit()
+
+    @staticmethod
+    def parse_price(price: str) -> Optional[float]:
+        """
+        Method that gets the number from the price label of the hotel, e.g. "$1,234" -> 1234.0
+
+        :param price: price label
+        :type price: str
+        :return: price, or None if the label has no price
+        :rtype: Optional[float]
+        """
+        digits: str = re.sub(r'[^\d.]', '', str(price))
+        try:
+            return float(digits)
+        except ValueError:
+            return None
+
+    def insert_prices(self, hotels: List[Hotel], check_in: date, check_out: date) -> None:
+        """
+        Method that appends the prices of the hotels for the given dates to the price history
+
+        :param hotels: the list of hotels from the API response
+        :type hotels: List[Hotel]
+        :param check_in: Check-in date
+        :type check_in: date
+        :param check_out: Check-out date
+        :type check_out: date
+        :return: None
+        """
+        observed_at: int = int(time.time())
+        day: str = date.fromtimestamp(observed_at).isoformat()
+        for i_hotel in hotels:
+            price: Optional[float] = self.parse_price(i_hotel.price)
+            if price is None:
+                continue
+            params = {'hotelId': str(i_hotel.id), 'checkIn': check_in.isoformat(), 'checkOut': check_out.isoformat(),
+                      'observedAt': observed_at, 'day': day, 'price': price}
+            self.cursor.execute(
+                "INSERT OR IGNORE INTO prices VALUES (:hotelId, :checkIn, :checkOut, :observedAt, :price)", params
+            )
+            if self.cursor.rowcount == 0:
+                # the price was already observed in this second
+                continue
+            self.cursor.execute(
+                "INSERT INTO price_rollups VALUES (:hotelId, :checkIn, :checkOut, :day, :price, :price, :price, 1) "
+                "ON CONFLICT (hotelId, checkIn, checkOut, day) DO UPDATE SET "
+                "minPrice=MIN(minPrice, excluded.minPrice), maxPrice=MAX(maxPrice, excluded.maxPrice), "
+                "total=total + excluded.total, count=count + 1",
+                params
+            )
+        self.conn.commit()
+
+    def get_price_history(self, hotel_id: str, start: date, end: date) -> List[Tuple[str, str, int, float]]:
+        """
+        Method that gets the observed prices of the hotel for the check-in dates in the given range
+
+        :param hotel_id: Hotel ID
+        :type hotel_id: str
+        :param start: first check-in date of the range
+        :type start: date
+        :param end: last check-in date of the range
+        :type end: date
+        :return: rows of (check-in, check-out, observed at, price)
+        :rtype: List[Tuple[str, str, int, float]]
+        """
+        self.cursor.execute(
+            "SELECT checkIn, checkOut, observedAt, price FROM prices WHERE hotelId=? AND checkIn BETWEEN ? AND ? "
+            "ORDER BY checkIn, checkOut, observedAt",
+            (str(hotel_id), start.isoformat(), end.isoformat())
+        )
+        return self.cursor.fetchall()
+
+    def get_cheapest_dates(self, hotel_id: str, limit: int = 5,
+                           since: Optional[date] = None) -> List[Tuple[str, str, float, float]]:
+        """
+        Method that gets the dates of stay with the lowest prices ever observed for the hotel.
+        Only the daily rollups are read, so the answer does not depend on the size of the price history
+
+        :param hotel_id: Hotel ID
+        :type hotel_id: str
+        :param limit: maximum number of date ranges
+        :type limit: int
+        :param since: the earliest check-in date. If None, today is used
+        :type since: Optional[date]
+        :return: rows of (check-in, check-out, minimal price, average price)
+        :rtype: List[Tuple[str, str, float, float]]
+        """
+        since = date.today() if since is None else since
+        self.cursor.execute(
+            "SELECT checkIn, checkOut, MIN(minPrice), SUM(total) / SUM(count) FROM price_rollups "
+            "WHERE hotelId=? AND checkIn>=? GROUP BY checkIn, checkOut ORDER BY MIN(minPrice), checkIn LIMIT ?",
+            (str(hotel_id), since.isoformat(), limit)
+        )
+        return self.cursor.fetchall()
+
+    def find_hotel(self, name: str) -> Optional[Hotel]:
+        """
+        Method that gets the hotel from database by its name
+
+        :param name: Hotel's name or a part of it
+        :type name: str
+        :return: Hotel, or None if there is no such hotel
+        :rtype: Optional[Hotel]
+        """
+        # % and _ in the name are matched literally
+        pattern: str = re.sub(r'([\\%_])', r'\\\1', name.strip())
+        self.cursor.execute("SELECT hotelId FROM hotels WHERE name LIKE ? ESCAPE '\\' ORDER BY name LIMIT 1",
+                            ('%{}%'.format(pattern),))
+        result: Optional[Tuple] = self.cursor.fetchone()
+        return None if result is None else self.get_hotel(result[0])
 
     def insert_request(self, user_id: int, command: str, city: str, hotels: List[Hotel]) -> None:
         """
@@ -136,6 +345,7 @@ class DataBase:
         :type hotels: List[Hotel]
         :return: None
         """
+        # the hotels and the request are written in one transaction, so the write lock is taken once
         for i_hotel in hotels:
             self.insert_hotel(i_hotel)
         self.cursor.execute(
@@ -144,21 +354,45 @@ class DataBase:
                 map(lambda x: str(x.id), hotels))
              }
         )
+        self.cursor.executemany(
+            "INSERT OR IGNORE INTO request_hotels VALUES (?, ?)",
+            [(self.cursor.lastrowid, str(i_hotel.id)) for i_hotel in hotels]
+        )
         self.conn.commit()
 
-    def get_hotel(self, hotel_id: str) -> Hotel:
+    def get_hotel(self, hotel_id: str) -> Optional[Hotel]:
         """
         Method that gets the hotels from database based on its ID
 
         :param hotel_id: Hotel ID
         :type hotel_id: str
-        :return: Hotel
+        :return: Hotel, or None if there is no such hotel
+        :rtype: Optional[Hotel]
         """
         self.cursor.execute("SELECT * FROM hotels WHERE hotelId=?", (hotel_id,))
-        result: Tuple = self.cursor.fetchone()
+        result: Optional[Tuple] = self.cursor.fetchone()
+        if result is None:
+            return None
         return Hotel(hotel_id=result[0], name=result[1], address=result[2], price=result[3], rating=result[4],
                      distance=result[5], images=None)
 
+    def get_requests_version(self, user_id: int) -> Tuple[int, int, int]:
+        """
+        Method that gets the version of the user's history: the last request ID, the number of requests
+        and the number of hotel renames. The version changes whenever a request is added or removed
+        or a hotel gets a new name
+
+        :param user_id: User ID
+        :type user_id: int
+        :return: version
+        :rtype: Tuple[int, int, int]
+        """
+        self.cursor.execute(
+            "SELECT IFNULL(MAX(requestId), 0), COUNT(*), (SELECT value FROM versions WHERE name='hotel_names') "
+            "FROM requests WHERE userId=?", (user_id,)
+        )
+        return self.cursor.fetchone()
+
     def get_requests(self, user_id: int) -> List[Request]:
         """
         Method that gets the request from teh user based on their ID
@@ -174,7 +408,10 @@ class DataBase:
         for i_request in result:
             hotels: List[Hotel] = list()
             for i_hotel_id in i_request[5].split(', '):
-                hotels.append(self.get_hotel(i_hotel_id))
+                hotel: Optional[Hotel] = self.get_hotel(i_hotel_id)
+                if hotel is not None:
+                    # the hotel could have been removed by the maintenance
+                    hotels.append(hotel)
             final.append(Request(i_request[0], i_request[2], i_request[3], i_request[4], hotels))
         final.reverse()
         return final
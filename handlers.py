@@ -1,4 +1,6 @@
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
+from datetime import date
+import render
 
 max_hotels: int = 15
 max_images: int = 10
@@ -29,29 +31,24 @@ class Hotel:
         self.distance: str = distance
 
     def __str__(self) -> str:
-        if self.rating == 'undefined':
-            rating = self.rating
-        else:
-            rating: str = ('⭐️' * int(round(self.rating, 0))) if self.rating >= .5 else '0'
-        return '🏨 Hotel: {name}\n💵 Price: {price}\n🌟 Rating: {rating}\n' \
-               '🗺 Address: {address}'.format(
-                    name=self.name, price=self.price, rating=rating, address=self.address
-                )
+        return render.render_hotel(self)
 
 
 def select_city(message, bot) -> None:
     """
-    Function that gets the City ID and redirects to the branch of choosing number of hotels 
+    Function that gets the City ID and redirects to the branch of choosing the dates of stay 
 
     :param message: User message that contains the city name
     :param bot: Instance of Bot class
     :return: None
     """
-    bot.info['city_name'] = message.text
-    bot.info['city'] = bot.requests.get_destination_id(message.text)
-    if bot.info['city'] == 'CITY_NOT_FOUND':
+    info: Dict[str, Any] = bot.get_info(message.from_user.id)
+    info['city_name'] = message.text
+    info['city'] = bot.requests.get_destination_id(message.text)
+    if info['city'] == 'CITY_NOT_FOUND':
         # if city was not found 
         bot.send_message(message.from_user.id, '😔 I dont have enough information about this city!')
+        bot.clear_data(message.from_user.id)
         return
     # if bot.info['command'] != '/bestdeal':
     #     # If the /bestdeal command is not being used - ask the number of hotels
@@ -59,8 +56,42 @@ def select_city(message, bot) -> None:
     #     bot.register_next_step_handler(msg, select_hotels_number, bot=bot)
     else:
         # If the /bestdeal command is being used
+        bot.save_info(message.from_user.id, info)
+        msg = bot.send_message(message.from_user.id, '📅 Enter check-in and check-out dates separated by space '
+                                                     '(YYYY-MM-DD YYYY-MM-DD):')
+        bot.register_next_step_handler(msg, select_dates, bot=bot)
+
+
+def select_dates(message, bot) -> None:
+    """
+    Function that gets the check-in and check-out dates and redirects to the branch of choosing number of hotels 
+
+    :param message: User message that contains the check-in and check-out dates
+    :param bot: Instance of Bot class
+    :return: None
+    """
+    check_in, check_out = None, None
+    if message.text is not None:
+        # if the message is not a sticker, photo, etc.
+        try:
+            check_in, check_out = map(date.fromisoformat, message.text.strip().split()[:2])
+        except ValueError:
+            pass
+
+    if check_in is not None and date.today() <= check_in < check_out:
+        # if the dates are correct
+        info: Dict[str, Any] = bot.get_info(message.from_user.id)
+        info['check_in'] = check_in.isoformat()
+        info['check_out'] = check_out.isoformat()
+        bot.save_info(message.from_user.id, info)
         msg = bot.send_message(message.from_user.id, '📝 Enter the number of hotels:')
         bot.register_next_step_handler(msg, select_hotels_number, bot=bot)
+    else:
+        # if the dates are incorrect or in the past
+        msg = bot.send_message(message.from_user.id, '☝️ The check-in date should not be in the past and should be '
+                                                     'before the check-out date\n'
+                                                     'Enter the dates one more time (YYYY-MM-DD YYYY-MM-DD):')
+        bot.register_next_step_handler(msg, select_dates, bot=bot)
 
 
 # def select_cost_range(message, bot) -> None:
@@ -103,14 +134,17 @@ def select_hotels_number(message, bot) -> None:
     """
     if 0 < int(message.text) <= max_hotels:
         # if the number of hotels is in possible range
-        bot.info['num'] = message.text
+        info: Dict[str, Any] = bot.get_info(message.from_user.id)
+        info['num'] = message.text
+        bot.save_info(message.from_user.id, info)
 
         # ? SHOULD THIS FEATURE BE KEPT TO MAKE A SEPARATE REQUEST FOR EACH HOTEL IF NEW API ALREADY PROVIDES ONE PICTURE IN A GENERAL REQUEST 
         # msg = bot.send_message(message.from_user.id, '📷 Do you want to get the image of each hotel?')
         # bot.register_next_step_handler(msg, images_need, bot=bot)
         hotels: List[Hotel] = bot.requests.get_hotels(
-            bot.info['city'], bot.info['num'], bot.info['sort'], 1,
-            cost_range=bot.info['cost_range'], distance_range=(0,0)
+            info['city'], info['num'], info['sort'], 1,
+            date.fromisoformat(info['check_in']), date.fromisoformat(info['check_out']),
+            cost_range=info['cost_range'], distance_range=(0,0)
         )
         bot.send_hotels(message.from_user.id, hotels)
     else:
@@ -120,6 +154,33 @@ def select_hotels_number(message, bot) -> None:
         bot.register_next_step_handler(msg, select_hotels_number, bot=bot)
 
 
+def select_cheapest_hotel(message, bot) -> None:
+    """
+    Function that gets the hotel name and sends the cheapest dates of stay found in the price history
+
+    :param message: User message that contains the hotel name
+    :param bot: Instance of Bot class
+    :return: None
+    """
+    if message.text is None:
+        # if the message is a sticker, photo, etc.
+        msg = bot.send_message(message.from_user.id, '☝️ Enter the hotel name as text:')
+        bot.register_next_step_handler(msg, select_cheapest_hotel, bot=bot)
+        return
+    bot.database.start()
+    hotel: Optional[Hotel] = bot.database.find_hotel(message.text)
+    dates = [] if hotel is None else bot.database.get_cheapest_dates(hotel.id)
+    bot.database.close()
+    if len(dates) == 0:
+        # if there are no prices of this hotel for the upcoming dates
+        bot.send_message(message.from_user.id, '😔 I have not seen the prices of this hotel for the upcoming dates!')
+        return
+    result: str = '\n• '.join(map(
+        lambda x: '{} - {}: ${:.0f} (average ${:.0f})'.format(*x), dates
+    ))
+    bot.send_message(message.from_user.id, '📅 The cheapest dates for {}:\n• {}'.format(hotel.name, result))
+
+
 # def images_need(message, bot) -> None:
 #     """
     # Function that gets the information whether or not the user needs images and redirects tot the branch of choosing the number of images or send hotels to the user
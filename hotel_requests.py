@@ -1,5 +1,5 @@
 from typing import List, Dict, Tuple, Optional, Union
-from dotenv import load_dotenv
+from datetime import date
 from handlers import Hotel
 import requests
 import json
@@ -11,12 +11,17 @@ class HotelRequests:
     Class executing the requests to Hotels API
 
         Args:
+            cache: the shared store to cache the responses in. If None, nothing is cached
+
+        Attributes:
             __x_rapidapi_key (str): the personal API key
             __headers (Dict[str: str]): settings for API requests    
+            session (requests.Session): pool of connections to the API, reused between the requests
     """
 
-    def __init__(self) -> None:
-        load_dotenv()
+    def __init__(self, cache=None) -> None:
+        self.cache = cache
+        self.session = requests.Session()
         self.__x_rapidapi_key: str = os.getenv('x_rapidapi_key')
         self.__headers: Dict[str: str] = {
             "content-type": "application/json",
@@ -24,6 +29,18 @@ class HotelRequests:
             "X-RapidAPI-Host": "hotels4.p.rapidapi.com"
     }
 
+    def warm_up(self) -> None:
+        """
+        Method that opens the connection to the API in advance, so the first user does not wait for it.
+        No API method is called, so the request is not counted by the API
+
+        :return: None
+        """
+        try:
+            self.session.head("https://hotels4.p.rapidapi.com", timeout=5)
+        except requests.RequestException:
+            pass
+
     def get_property_details(self, hotelId: str) -> Tuple[Union[str, int], str]:
         """
         Methods that makes a request to the API to get the rating and address from the hotel
@@ -46,7 +63,7 @@ class HotelRequests:
             "propertyId": str(hotelId)
         }
 
-        response = requests.request("POST", url, json=payload, headers=self.__headers)
+        response = self.session.request("POST", url, json=payload, headers=self.__headers)
 
         save_file = open("file4.json", "w")  
         json.dump(json.loads(response.text), save_file, indent = 4)  
@@ -60,7 +77,7 @@ class HotelRequests:
 
         return stars, address
 
-    def get_hotels(self, destination_id: str, number: int, sort: str, images_num: int,
+    def get_hotels(self, destination_id: str, number: int, sort: str, images_num: int, check_in: date, check_out: date,
                    cost_range: Optional[Tuple[str]] = None, distance_range: Optional[Tuple[str]] = None) -> List[Hotel]:
         """
         Final method that gets the hotels based on all criteria
@@ -74,6 +91,10 @@ class HotelRequests:
         :type sort: str
         :param images_num: Number of pictures for each hotel 
         :type images_num: int
+        :param check_in: Check-in date
+        :type check_in: date
+        :param check_out: Check-out date
+        :type check_out: date
         :param cost_range: Tuple that contains the range of possible prices.
             1st value - minimal price, 2nd - maximum price
         :type cost_range: Optional[Tuple[str]]
@@ -94,14 +115,14 @@ class HotelRequests:
             "siteId": 300000001,
             "destination": {"regionId": str(destination_id)},
             "checkInDate": {
-                "day": 10,
-                "month": 10,
-                "year": 2022
+                "day": check_in.day,
+                "month": check_in.month,
+                "year": check_in.year
             },
             "checkOutDate": {
-                "day": 15,
-                "month": 10,
-                "year": 2022
+                "day": check_out.day,
+                "month": check_out.month,
+                "year": check_out.year
             },
             "rooms": [
                 {
@@ -114,7 +135,7 @@ class HotelRequests:
             "sort": sort
         }
         
-        response = requests.request("POST", url, json=payload, headers=self.__headers)
+        response = self.session.request("POST", url, json=payload, headers=self.__headers)
         hotels = json.loads(response.text).get('data', {}).get('propertySearch', {}).get('properties', {})
 
         hotels_list = []
@@ -151,9 +172,14 @@ class HotelRequests:
         :return: 'CITY_NOT_FOUND'
         :rtype: str
         """
+        if self.cache is not None:
+            cached: Optional[str] = self.cache.get_cache('destination:' + city.strip().lower())
+            if cached is not None:
+                return cached
+
         url: str = "https://hotels4.p.rapidapi.com/locations/v3/search"
         querystring = {"q": city,"locale":"en_US","langid":"1033","siteid":"300000001"}
-        response: dict = json.loads(requests.request("GET", url, headers=self.__headers, params=querystring).text)
+        response: dict = json.loads(self.session.request("GET", url, headers=self.__headers, params=querystring).text)
 
         destination_id: Optional[str] = None
         try:
@@ -161,6 +187,8 @@ class HotelRequests:
         except IndexError:
             destination_id = 'CITY_NOT_FOUND'
         finally:
+            if self.cache is not None and destination_id != 'CITY_NOT_FOUND':
+                self.cache.set_cache('destination:' + city.strip().lower(), destination_id)
             return destination_id
 
     # def get_photos(self, hotel_id: str, num: Union[str, int]) -> Optional[List[str]]:
@@ -191,12 +219,15 @@ class HotelRequests:
 
 
 if __name__ == '__main__':
-    
+    from dotenv import load_dotenv
+    load_dotenv()
+
     hotelsR = HotelRequests()
 
     # print(hotelsR.get_destination_id('New York')) # -> 2621
 
-    # hotels = hotelsR.get_hotels('2621', 3, 'PRICE_LOW_TO_HIGH', 1, (100, 150), (0,0))
+    # hotels = hotelsR.get_hotels('2621', 3, 'PRICE_LOW_TO_HIGH', 1, date(2022, 10, 10), date(2022, 10, 15),
+    #                             (100, 150), (0,0))
 
     # for h in hotels:
     #     print(f'{h.id}:\n{h}\nImage: {h.images}\n\n')
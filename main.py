@@ -1,10 +1,17 @@
+import time
+started: float = time.perf_counter()
+
 from telebot.types import InputMediaPhoto
 from hotel_requests import HotelRequests
-from typing import Dict, List, Optional, Union
+from shared_state import SharedStore, SharedHandlerBackend
+from typing import Any, Dict, List, Optional, Union
+from functools import cached_property
+from datetime import date
 from data_base import DataBase
-from dotenv import load_dotenv
+import threading
 import handlers
 import telebot
+import render
 import os
 
 
@@ -14,28 +21,164 @@ class Bot(telebot.TeleBot):
 
     Args:
         token (str): Bot token
+        store (Optional[SharedStore]): Store shared by worker processes. If None, the state is kept in memory
+        threaded (bool): Whether the updates are handled in a thread pool
+        template (Optional[str]): Template of hotel cards and history: None for plain text, "HTML" or "MarkdownV2"
 
     Attributes:
-        requests (HotelRequests): Instance of the class, executing requests to hotels API
-        database (DataBase): Instance of the class that controls and manages the requests history database
-        info (Optional[Dict[str, Optional[str, int]]]): Dictionary of user's request criteria
+        requests (HotelRequests): Instance of the class, executing requests to hotels API. Created on the first use
+        database (DataBase): Instance of the class that controls and manages the requests history database.
+            Created on the first use
+        store (Optional[SharedStore]): Store of the request criteria, next step handlers and caches
+        info (Dict[int, Dict[str, Optional[Union[str, int]]]]): Request criteria of each chat when there is no store
+        updated (Dict[int, float]): The time of the last change of the criteria of each chat when there is no store
+        collected (float): The time the abandoned criteria were last removed when there is no store
+        template (Optional[str]): Template of hotel cards and history
 
     """
-    def __init__(self, token: str) -> None:
-        super().__init__(token)
-        self.requests = HotelRequests()
-        self.database = DataBase('history.db')
-        self.info: Optional[Dict[str, Optional[Union[str, int]]]] = None
-        self.clear_data()
+    def __init__(self, token: str, store: Optional[SharedStore] = None, threaded: bool = True,
+                 template: Optional[str] = None) -> None:
+        backend: Optional[SharedHandlerBackend] = None if store is None else SharedHandlerBackend(store)
+        super().__init__(token, threaded=threaded, next_step_backend=backend)
+        if backend is not None:
+            backend.bot = self
+        self.store: Optional[SharedStore] = store
+        self.info: Dict[int, Dict[str, Optional[Union[str, int]]]] = dict()
+        self.updated: Dict[int, float] = dict()
+        self.collected: float = time.monotonic()
+        self.info_lock = threading.Lock()
+        if template not in render.templates:
+            print('The template {} is unknown, plain text is used instead. Possible templates: {}'.format(
+                template, ', '.join(str(i_template) for i_template in render.templates if i_template is not None)
+            ))
+            template = None
+        self.template: Optional[str] = template
+
+    @cached_property
+    def requests(self) -> HotelRequests:
+        """
+        Instance of the class, executing requests to hotels API. Created on the first use
+
+        :return: requests
+        :rtype: HotelRequests
+        """
+        return HotelRequests(cache=self.store)
+
+    @cached_property
+    def database(self) -> DataBase:
+        """
+        Instance of the class that controls and manages the requests history database. Created on the first use
+
+        :return: database
+        :rtype: DataBase
+        """
+        return DataBase('history.db')
+
+    def warm_up(self, started: Optional[float] = None) -> None:
+        """
+        Method that prepares the database schema, the shared store and the connection to hotels API
+        in the background thread, so the bot can start polling without waiting for them
+
+        :param started: the time.perf_counter() value at the start of the process, to report the time to ready.
+            If None, the time of the warm-up is reported
+        :type started: Optional[float]
+        :return: None
+        """
+        def warm() -> None:
+            begin: float = time.perf_counter() if started is None else started
+            try:
+                # a separate instance, the handler threads may already be using self.database
+                database: DataBase = DataBase('history.db')
+                database.start()
+                database.close()
+                if self.store is not None:
+                    with self.store.lock:
+                        self.store.connect()
+                self.requests.warm_up()
+                print('The bot is {} in {:.0f} ms'.format(
+                    'warmed up' if started is None else 'ready', (time.perf_counter() - begin) * 1000
+                ))
+            except Exception as exception:
+                print('The Exception occurred while warming up the bot: {}'.format(exception))
+
+        threading.Thread(target=warm, name='warm-up', daemon=True).start()
+
+    @staticmethod
+    def empty_info() -> Dict[str, Optional[Union[str, int]]]:
+        """
+        Method returning the criteria of a new request
+
+        :return: info
+        :rtype: Dict[str, Optional[Union[str, int]]]
+        """
+        return {'city': None, 'city_name': None, 'num': None, 'sort': None, 'images_num': 1, 'cost_range': None,
+                'distance_range': None, 'command': None, 'check_in': None, 'check_out': None}
+
+    def get_info(self, chat_id: int) -> Dict[str, Any]:
+        """
+        Method getting the criteria of the request of the chat
+
+        :param chat_id: Chat id
+        :type chat_id: int
+        :return: info
+        :rtype: Dict[str, Any]
+        """
+        info: Optional[Dict[str, Any]] = \
+            self.info.get(chat_id) if self.store is None else self.store.load_info(chat_id)
+        return self.empty_info() if info is None else info
+
+    def save_info(self, chat_id: int, info: Dict[str, Any]) -> None:
+        """
+        Method saving the criteria of the request of the chat
+
+        :param chat_id: Chat id
+        :type chat_id: int
+        :param info: Criteria of the request
+        :type info: Dict[str, Any]
+        :return: None
+        """
+        if self.store is None:
+            with self.info_lock:
+                self.info[chat_id] = info
+                self.updated[chat_id] = time.monotonic()
+            if time.monotonic() - self.collected > 60 * 60:
+                self.collect_info()
+        else:
+            self.store.save_info(chat_id, info)
+
+    def clear_data(self, chat_id: int) -> None:
+        """
+        Method clearing the criteria of the request of the chat
+
+        :param chat_id: Chat id
+        :type chat_id: int
+        :return: None
+        """
+        if self.store is None:
+            with self.info_lock:
+                self.info.pop(chat_id, None)
+                self.updated.pop(chat_id, None)
+        else:
+            self.store.clear_info(chat_id)
 
-    def clear_data(self) -> None:
+    def collect_info(self, max_age: float = 24 * 60 * 60) -> None:
         """
-        Method clearing the criteria of the request
+        Method removing the criteria of the requests abandoned for max_age seconds together with
+        the next step handlers of their chats, when the state is kept in memory
 
+        :param max_age: the time since the last change of abandoned criteria in seconds
+        :type max_age: float
         :return: None
         """
-        self.info = {'city': None, 'city_name': None, 'num': None, 'sort': None, 'images_num': 1, 'cost_range': None,
-                     'distance_range': None, 'command': None}
+        with self.info_lock:
+            self.collected = time.monotonic()
+            abandoned: List[int] = [i_chat_id for i_chat_id, i_updated in self.updated.items()
+                                    if self.collected - i_updated > max_age]
+            for i_chat_id in abandoned:
+                self.info.pop(i_chat_id, None)
+                self.updated.pop(i_chat_id, None)
+        for i_chat_id in abandoned:
+            self.clear_step_handler_by_chat_id(i_chat_id)
 
     def send_info(self, chat_id: int) -> None:
         """
@@ -49,7 +192,8 @@ class Bot(telebot.TeleBot):
                                    "📉 /lowprice - show top cheap hotels\n"
                                    "💷 /highprice - show top premium hotels\n"
                                 #    "📈 /bestdeal - show top optimal hotels\n"
-                                   "📖 /history - show the history of requested hotels")
+                                   "📖 /history - show the history of requested hotels\n"
+                                   "📅 /cheapest - show the cheapest dates for a hotel")
 
     def send_hotels(self, chat_id: int, hotels: List[handlers.Hotel]) -> None:
         """
@@ -67,8 +211,9 @@ class Bot(telebot.TeleBot):
                                        'Make sure that all data are entered correctly!')
             return
 
+        info: Dict[str, Any] = self.get_info(chat_id)
         num: int = 1
-        if len(hotels) == int(self.info['num']):
+        if len(hotels) == int(info['num']):
             # if enough hotels were found
             self.send_message(chat_id, 'Your hotels:')
         else:
@@ -77,23 +222,32 @@ class Bot(telebot.TeleBot):
 
         # sending hotels
         for i_hotel in hotels:
-            msg: str = '{}) {}'.format(num, i_hotel)
-            if int(self.info['images_num']) == 0:
-                self.send_message(chat_id, msg)
+            msg: str = render.templates[self.template]['numbered'].format(
+                number=num, card=render.render_hotel(i_hotel, self.template)
+            )
+            if int(info['images_num']) == 0:
+                for i_part in render.split_message(msg):
+                    self.send_message(chat_id, i_part, parse_mode=self.template)
             else:
                 media: List[InputMediaPhoto] = list()
                 for i_image in i_hotel.images:
                     media.append(InputMediaPhoto(i_image))
-                media[0].caption = msg
+                parts: List[str] = render.split_message(msg, render.max_caption_length)
+                media[0].caption = parts[0]
+                media[0].parse_mode = self.template
                 self.send_media_group(chat_id, media)
+                # the rest of a card longer than a caption is sent after the images
+                for i_part in parts[1:]:
+                    self.send_message(chat_id, i_part, parse_mode=self.template)
             num += 1
 
         # Adding the request to database
         self.database.start()
-        self.database.insert_request(user_id=chat_id, command=self.info['command'], city=self.info['city_name'],
+        self.database.insert_request(user_id=chat_id, command=info['command'], city=info['city_name'],
                                      hotels=hotels)
+        self.database.insert_prices(hotels, date.fromisoformat(info['check_in']), date.fromisoformat(info['check_out']))
         self.database.close()
-        self.clear_data()
+        self.clear_data(chat_id)
 
     def say_hello(self, user) -> None:
         """
@@ -112,8 +266,10 @@ class Bot(telebot.TeleBot):
         :type chat_id: int
         :return: None
         """
-        self.info['sort'] = 'PRICE_LOW_TO_HIGH'
-        self.info['command'] = '/lowprice'
+        info: Dict[str, Any] = self.empty_info()
+        info['sort'] = 'PRICE_LOW_TO_HIGH'
+        info['command'] = '/lowprice'
+        self.save_info(chat_id, info)
         msg = self.send_message(chat_id, '🌆 Enter your city:')
         self.register_next_step_handler(msg, handlers.select_city, bot=self)
 
@@ -125,8 +281,10 @@ class Bot(telebot.TeleBot):
         :type chat_id: int
         :return: None
         """
-        self.info['sort'] = 'PRICE_HIGH_TO_LOW'
-        self.info['command'] = '/highprice'
+        info: Dict[str, Any] = self.empty_info()
+        info['sort'] = 'PRICE_HIGH_TO_LOW'
+        info['command'] = '/highprice'
+        self.save_info(chat_id, info)
         msg = self.send_message(chat_id, '🌆 Enter your city:')
         self.register_next_step_handler(msg, handlers.select_city, bot=self)
 
@@ -143,6 +301,17 @@ class Bot(telebot.TeleBot):
     #     msg = self.send_message(chat_id, '🌆 Enter your city:')
     #     self.register_next_step_handler(msg, handlers.select_city, bot=self)
 
+    def send_cheapest_hotels(self, chat_id: int) -> None:
+        """
+        Method starting a branch to find the cheapest dates of stay for a hotel from the price history
+
+        :param chat_id: Chat id in which the message needs to be sent
+        :type chat_id: int
+        :return: None
+        """
+        msg = self.send_message(chat_id, '🏨 Enter the hotel name:')
+        self.register_next_step_handler(msg, handlers.select_cheapest_hotel, bot=self)
+
     def send_history(self, chat_id: int) -> None:
         """
         Method sending the history of requested hotels to the user
@@ -152,20 +321,25 @@ class Bot(telebot.TeleBot):
         :return: None
         """
         self.database.start()
-        history: str = '\n\n'.join(map(lambda x: str(x), self.database.get_requests(chat_id)))
-        if len(history) != 0:
-            self.send_message(chat_id, '📖 Your history of requests:\n\n{}'.format(history))
-        else:
-            self.send_message(chat_id, '📖 Your history of requests is empty!')
+        # the rendered history is reused until the user makes a new request, old ones are removed
+        # or a hotel is renamed
+        key = ('history', chat_id, self.database.get_requests_version(chat_id), self.template)
+        messages: Optional[List[str]] = render.cache.get(key)
+        if messages is None:
+            messages = render.render_history(self.database.get_requests(chat_id), self.template)
+            render.cache.put(key, messages)
         self.database.close()
+        for i_message in messages:
+            self.send_message(chat_id, i_message, parse_mode=self.template)
 
 
-if __name__ == '__main__':
-    load_dotenv()
-    TOKEN: str = os.getenv('TOKEN')
-    bot = Bot(TOKEN)
-
+def register_handlers(bot: Bot) -> None:
+    """
+    Function registering the message handlers of the bot
 
+    :param bot: Instance of Bot class
+    :return: None
+    """
     @bot.message_handler(content_types=['text'])
     def reply(message) -> None:
         """
@@ -192,8 +366,31 @@ if __name__ == '__main__':
         elif message.text.strip().lower() == '/history':
             bot.send_history(message.from_user.id)
 
+        elif message.text.strip().lower() == '/cheapest':
+            bot.send_cheapest_hotels(message.from_user.id)
+
         else:
             bot.send_message(message.from_user.id, "😔 I don't understand you.\n"
                                                    "Type /help to see the list of commands")
 
-    bot.polling(none_stop=True, interval=0)
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+    TOKEN: str = os.getenv('TOKEN')
+    WORKERS: int = int(os.getenv('WORKERS', 1))
+    TEMPLATE: Optional[str] = os.getenv('TEMPLATE') or None
+
+    if WORKERS > 1:
+        # updates are sharded by chat between worker processes sharing the state in a local store
+        import workers
+        workers.run(TOKEN, WORKERS, 'state.db', started, TEMPLATE)
+    else:
+        from maintenance import Maintenance
+        bot = Bot(TOKEN, template=TEMPLATE)
+        register_handlers(bot)
+        bot.warm_up(started)
+        Maintenance('history.db').start()
+        # the warm-up may still be running, the time to ready is reported at its end
+        print('The bot is polling in {:.0f} ms'.format((time.perf_counter() - started) * 1000))
+        bot.polling(none_stop=True, interval=0)
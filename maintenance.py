@@ -0,0 +1,259 @@
+from typing import Any, Dict, List, Tuple
+from data_base import DataBase
+from datetime import datetime
+import threading
+import time
+import gzip
+import json
+import sys
+import os
+
+max_requests_per_user: int = 50
+max_request_age_days: int = 180
+
+
+class Maintenance:
+    """
+    Class that keeps the size of the history database bounded.
+    Old requests, prices and hotels are archived to compressed files and removed in small batches,
+    so the bot can keep using the database while the maintenance is running
+
+    Args:
+        filename (str): the filename of database
+        archive_dir (str): the directory of the archive files
+        max_requests (int): the number of latest requests kept for each user
+        max_days (int): the number of days the requests and prices are kept for
+        batch_size (int): the number of rows removed in one transaction
+        pause (float): the pause between the transactions in seconds
+        vacuum_pages (int): the number of free pages returned to the file system in one run
+
+    Attributes:
+        database (DataBase): the database being maintained
+        archive: the archive file of the current run, opened on the first archived row
+        stop_event (threading.Event): event stopping the background maintenance
+
+    """
+    def __init__(self, filename: str, archive_dir: str = 'archive', max_requests: int = max_requests_per_user,
+                 max_days: int = max_request_age_days, batch_size: int = 500, pause: float = 0.05,
+                 vacuum_pages: int = 1000) -> None:
+        self.database = DataBase(filename)
+        self.archive_dir: str = archive_dir
+        self.max_requests: int = max_requests
+        self.max_days: int = max_days
+        self.batch_size: int = batch_size
+        self.pause: float = pause
+        self.vacuum_pages: int = vacuum_pages
+        self.archive = None
+        self.stop_event = threading.Event()
+
+    def start(self, interval: float = 6 * 60 * 60) -> None:
+        """
+        Method that runs the maintenance in the background thread every interval seconds
+
+        :param interval: the interval between the runs in seconds
+        :type interval: float
+        :return: None
+        """
+        def loop() -> None:
+            while not self.stop_event.is_set():
+                try:
+                    print('The maintenance of the database is done: {}'.format(self.run()))
+                except Exception as exception:
+                    print('The Exception occurred during the maintenance of the database: {}'.format(exception))
+                self.stop_event.wait(interval)
+
+        threading.Thread(target=loop, name='maintenance', daemon=True).start()
+
+    def stop(self) -> None:
+        """
+        Method that stops the background maintenance after the current run
+        :return: None
+        """
+        self.stop_event.set()
+
+    def run(self) -> Dict[str, int]:
+        """
+        Method that runs all maintenance steps once
+
+        :return: the number of removed rows of each table
+        :rtype: Dict[str, int]
+        """
+        self.database.start()
+        try:
+            result: Dict[str, int] = {
+                'requests': self.prune_requests(),
+                'prices': self.prune_prices(),
+                'price_rollups': self.prune_rollups(),
+                'hotels': self.collect_hotels()
+            }
+            self.vacuum()
+        finally:
+            if self.archive is not None:
+                self.archive.close()
+                self.archive = None
+            self.database.close()
+        return result
+
+    def archive_rows(self, table: str, rows: List[Tuple]) -> None:
+        """
+        Method that writes the rows to the compressed archive file of the current run
+
+        :param table: the table the rows are from
+        :type table: str
+        :param rows: rows of the table
+        :type rows: List[Tuple]
+        :return: None
+        """
+        if self.archive is None:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            filename: str = os.path.join(
+                self.archive_dir, 'history-{}.jsonl.gz'.format(datetime.now().strftime('%Y%m%d-%H%M%S'))
+            )
+            self.archive = gzip.open(filename, 'at', encoding='utf-8')
+        columns: List[str] = [i_column[1] for i_column in
+                              self.database.conn.execute('PRAGMA table_info({})'.format(table)).fetchall()]
+        for i_row in rows:
+            self.archive.write(json.dumps({'table': table, 'row': dict(zip(columns, i_row))}) + '\n')
+        # the rows have to be on the disk before they are deleted from the database
+        self.archive.flush()
+
+    def remove(self, table: str, key: List[str], select: str, params: Tuple[Any, ...] = ()) -> int:
+        """
+        Method that archives and deletes the rows of the table in batches
+
+        :param table: the table the rows are deleted from
+        :type table: str
+        :param key: the columns identifying a row
+        :type key: List[str]
+        :param select: query selecting the rows to delete. It is given the limit as the last parameter
+        :type select: str
+        :param params: parameters of the query
+        :type params: Tuple[Any, ...]
+        :return: the number of deleted rows
+        :rtype: int
+        """
+        columns: List[str] = [i_column[1] for i_column in
+                              self.database.conn.execute('PRAGMA table_info({})'.format(table)).fetchall()]
+        positions: List[int] = [columns.index(i_column) for i_column in key]
+        delete: str = 'DELETE FROM {} WHERE {}'.format(table, ' AND '.join('{}=?'.format(i) for i in key))
+        removed: int = 0
+        while True:
+            self.database.cursor.execute(select, params + (self.batch_size,))
+            rows: List[Tuple] = self.database.cursor.fetchall()
+            if len(rows) == 0:
+                return removed
+            self.archive_rows(table, rows)
+            self.database.cursor.executemany(delete, [tuple(i_row[i] for i in positions) for i_row in rows])
+            self.database.conn.commit()
+            removed += len(rows)
+            # letting the bot take the write lock between the batches
+            time.sleep(self.pause)
+
+    def prune_requests(self) -> int:
+        """
+        Method that removes the requests older than max_days and the requests beyond the latest max_requests
+        of each user
+
+        :return: the number of removed requests
+        :rtype: int
+        """
+        removed: int = self.remove(
+            'requests', ['requestId'],
+            "SELECT * FROM requests WHERE time < DATETIME('now', ?) LIMIT ?", ('-{} days'.format(self.max_days),)
+        )
+        removed += self.remove(
+            'requests', ['requestId'],
+            "SELECT * FROM requests WHERE requestId IN (SELECT requestId FROM (SELECT requestId, ROW_NUMBER() "
+            "OVER (PARTITION BY userId ORDER BY requestId DESC) AS number FROM requests) WHERE number > ?) LIMIT ?",
+            (self.max_requests,)
+        )
+        return removed
+
+    def prune_prices(self) -> int:
+        """
+        Method that removes the prices observed more than max_days ago
+
+        :return: the number of removed prices
+        :rtype: int
+        """
+        return self.remove(
+            'prices', ['hotelId', 'checkIn', 'checkOut', 'observedAt'],
+            "SELECT * FROM prices WHERE observedAt < ? LIMIT ?", (int(time.time()) - self.max_days * 24 * 60 * 60,)
+        )
+
+    def prune_rollups(self) -> int:
+        """
+        Method that removes the daily price rollups of the stays that are already over
+
+        :return: the number of removed rollups
+        :rtype: int
+        """
+        return self.remove(
+            'price_rollups', ['hotelId', 'checkIn', 'checkOut', 'day'],
+            "SELECT * FROM price_rollups WHERE checkOut < DATE('now') LIMIT ?"
+        )
+
+    def collect_hotels(self) -> int:
+        """
+        Method that removes the hotels that are not referenced by any request or price
+
+        :return: the number of removed hotels
+        :rtype: int
+        """
+        # the references are checked while the write lock is held, so the bot cannot refer to a hotel
+        # between the check and the deletion. Both checks are index lookups, so the lock is held shortly
+        unreferenced: str = (
+            "SELECT * FROM hotels WHERE NOT EXISTS (SELECT 1 FROM prices WHERE prices.hotelId=hotels.hotelId) "
+            "AND NOT EXISTS (SELECT 1 FROM request_hotels WHERE request_hotels.hotelId=hotels.hotelId) LIMIT ?"
+        )
+        removed: int = 0
+        while True:
+            self.database.conn.commit()
+            self.database.cursor.execute("BEGIN IMMEDIATE")
+            try:
+                self.database.cursor.execute(unreferenced, (self.batch_size,))
+                rows: List[Tuple] = self.database.cursor.fetchall()
+                if len(rows) != 0:
+                    self.archive_rows('hotels', rows)
+                    self.database.cursor.executemany("DELETE FROM hotels WHERE hotelId=?",
+                                                     [(i_row[0],) for i_row in rows])
+                self.database.conn.commit()
+            except BaseException:
+                self.database.conn.rollback()
+                raise
+            if len(rows) == 0:
+                return removed
+            removed += len(rows)
+            time.sleep(self.pause)
+
+    def vacuum(self) -> None:
+        """
+        Method that returns a part of the free pages of the database file to the file system.
+        A database created without incremental auto vacuum has to be converted by convert() first
+        :return: None
+        """
+        if self.database.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            self.database.conn.execute("PRAGMA incremental_vacuum({})".format(int(self.vacuum_pages))).fetchall()
+        self.database.conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+
+    def convert(self) -> None:
+        """
+        Method that turns on incremental auto vacuum of a database created without it.
+        The whole file is rewritten while the database is locked, so it must be run while the bot is stopped
+        :return: None
+        """
+        self.database.start()
+        try:
+            if self.database.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                self.database.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                self.database.conn.execute("VACUUM")
+        finally:
+            self.database.close()
+
+
+if __name__ == '__main__':
+    maintenance = Maintenance('history.db')
+    if '--convert' in sys.argv:
+        # offline step for the databases created before the incremental auto vacuum
+        maintenance.convert()
+    print(maintenance.run())
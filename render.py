@@ -0,0 +1,220 @@
+from typing import Any, Callable, Dict, Hashable, List, Optional
+from collections import OrderedDict
+import threading
+import html
+import re
+
+max_message_length: int = 4096
+max_caption_length: int = 1024
+
+templates: Dict[Optional[str], Dict[str, str]] = {
+    None: {
+        'hotel': '🏨 Hotel: {name}\n💵 Price: {price}\n🌟 Rating: {rating}\n🗺 Address: {address}',
+        'request': '✅ The result of the request based on the {command} command in {city} at {date}:\n• {result}',
+        'history': '📖 Your history of requests:\n\n{history}',
+        'empty_history': '📖 Your history of requests is empty!',
+        'numbered': '{number}) {card}'
+    },
+    'HTML': {
+        'hotel': '🏨 <b>Hotel:</b> {name}\n💵 <b>Price:</b> {price}\n🌟 <b>Rating:</b> {rating}\n'
+                 '🗺 <b>Address:</b> {address}',
+        'request': '✅ The result of the request based on the <b>{command}</b> command in <b>{city}</b> '
+                   'at <i>{date}</i>:\n• {result}',
+        'history': '📖 <b>Your history of requests:</b>\n\n{history}',
+        'empty_history': '📖 Your history of requests is empty!',
+        'numbered': '{number}) {card}'
+    },
+    'MarkdownV2': {
+        'hotel': '🏨 *Hotel:* {name}\n💵 *Price:* {price}\n🌟 *Rating:* {rating}\n🗺 *Address:* {address}',
+        'request': '✅ The result of the request based on the *{command}* command in *{city}* '
+                   'at _{date}_:\n• {result}',
+        'history': '📖 *Your history of requests:*\n\n{history}',
+        'empty_history': '📖 Your history of requests is empty\\!',
+        'numbered': '{number}\\) {card}'
+    }
+}
+
+
+def escape_markdown(text: str) -> str:
+    """
+    Function that escapes the special characters of MarkdownV2
+
+    :param text: text to escape
+    :type text: str
+    :return: text
+    :rtype: str
+    """
+    return re.sub(r'([_*\[\]()~`>#+\-=|{}.!\\])', r'\\\1', text)
+
+
+escapes: Dict[Optional[str], Callable[[str], str]] = {None: str, 'HTML': html.escape, 'MarkdownV2': escape_markdown}
+
+
+class RenderCache:
+    """
+    Class keeping the latest rendered messages. The least recently used ones are removed first
+
+    Args:
+        size (int): the maximum number of messages in the cache
+
+    Attributes:
+        items (OrderedDict): rendered messages by their keys
+        lock: lock guarding the cache between the threads of the bot
+
+    """
+    def __init__(self, size: int = 2048) -> None:
+        self.size: int = size
+        self.items: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Method that gets the rendered message from the cache
+
+        :param key: key of the message
+        :type key: Hashable
+        :return: message, or None if it is not in the cache
+        :rtype: Optional[Any]
+        """
+        with self.lock:
+            value: Optional[Any] = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Method that puts the rendered message to the cache
+
+        :param key: key of the message
+        :type key: Hashable
+        :param value: message
+        :type value: Any
+        :return: None
+        """
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+cache = RenderCache()
+
+
+def render_hotel(hotel, parse_mode: Optional[str] = None) -> str:
+    """
+    Function that renders the card of the hotel.
+    The card is cached by the hotel's content, so a hotel with a new price is rendered again
+
+    :param hotel: Instance of Hotel class
+    :param parse_mode: parse mode of the message: None, "HTML" or "MarkdownV2"
+    :type parse_mode: Optional[str]
+    :return: card
+    :rtype: str
+    """
+    key = ('hotel', hotel.id, hotel.name, hotel.price, hotel.rating, hotel.address, parse_mode)
+    card: Optional[str] = cache.get(key)
+    if card is None:
+        if hotel.rating == 'undefined':
+            rating = hotel.rating
+        else:
+            rating: str = ('⭐️' * int(round(hotel.rating, 0))) if hotel.rating >= .5 else '0'
+        escape: Callable[[str], str] = escapes[parse_mode]
+        card = templates[parse_mode]['hotel'].format(
+            name=escape(str(hotel.name)), price=escape(str(hotel.price)), rating=escape(rating),
+            address=escape(str(hotel.address))
+        )
+        cache.put(key, card)
+    return card
+
+
+def render_request(request, parse_mode: Optional[str] = None) -> str:
+    """
+    Function that renders the result of the request from the history.
+    The result is cached by the request ID and the names of its hotels, which can be updated
+
+    :param request: Instance of Request class
+    :param parse_mode: parse mode of the message: None, "HTML" or "MarkdownV2"
+    :type parse_mode: Optional[str]
+    :return: result
+    :rtype: str
+    """
+    key = ('request', request.id, tuple(map(lambda x: x.name, request.hotels)), parse_mode)
+    result: Optional[str] = cache.get(key)
+    if result is None:
+        escape: Callable[[str], str] = escapes[parse_mode]
+        result = templates[parse_mode]['request'].format(
+            command=escape(request.command), city=escape(request.city), date=escape(str(request.date)),
+            result='\n• '.join(map(lambda x: escape(str(x.name)), request.hotels))
+        )
+        cache.put(key, result)
+    return result
+
+
+def render_history(requests: List, parse_mode: Optional[str] = None) -> List[str]:
+    """
+    Function that renders the history of requests split to messages fitting the Telegram limit
+
+    :param requests: the list of Request instances
+    :type requests: List
+    :param parse_mode: parse mode of the message: None, "HTML" or "MarkdownV2"
+    :type parse_mode: Optional[str]
+    :return: messages
+    :rtype: List[str]
+    """
+    if len(requests) == 0:
+        return [templates[parse_mode]['empty_history']]
+    history: str = '\n\n'.join(map(lambda x: render_request(x, parse_mode), requests))
+    return split_message(templates[parse_mode]['history'].format(history=history))
+
+
+def safe_cut(text: str, limit: int) -> int:
+    """
+    Function that finds the position inside a line where the text can be cut
+    without breaking an HTML tag or entity, or separating a MarkdownV2 backslash from the escaped character
+
+    :param text: text to cut
+    :type text: str
+    :param limit: the maximum position of the cut
+    :type limit: int
+    :return: position
+    :rtype: int
+    """
+    cut: int = limit
+    tag: int = text.rfind('<', 0, cut)
+    if tag > text.rfind('>', 0, cut) and cut - tag <= 16:
+        cut = tag
+    entity: int = text.rfind('&', 0, cut)
+    if entity > text.rfind(';', 0, cut) and cut - entity <= 10:
+        cut = entity
+    backslashes: int = len(text[:cut]) - len(text[:cut].rstrip('\\'))
+    if backslashes % 2 == 1:
+        cut -= 1
+    return cut if cut > 0 else limit
+
+
+def split_message(text: str, limit: int = max_message_length) -> List[str]:
+    """
+    Function that splits the text to messages not longer than the limit.
+    The text is split between the paragraphs, then between the lines, and only then inside a line,
+    where the cut is moved before an HTML tag or entity and before a MarkdownV2 escape
+
+    :param text: text to split
+    :type text: str
+    :param limit: the maximum length of a message
+    :type limit: int
+    :return: messages
+    :rtype: List[str]
+    """
+    messages: List[str] = list()
+    while len(text) > limit:
+        cut: int = text.rfind('\n\n', 0, limit)
+        if cut <= 0:
+            cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = safe_cut(text, limit)
+        messages.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    messages.append(text)
+    return messages
@@ -0,0 +1,290 @@
+from telebot.handler_backends import HandlerBackend
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from telebot import Handler
+import importlib
+import threading
+import sqlite3
+import json
+import time
+
+
+class SharedStore:
+    """
+    Class that keeps the conversation state, next step handlers and caches in a local SQLite file,
+    so that several worker processes can serve the same users
+
+    Args:
+        filename (str): the filename of the shared store
+
+    Attributes:
+        conn: connection to the store, opened lazily in every process that uses it
+        lock: lock guarding the connection between the threads of one process
+
+    """
+    def __init__(self, filename: str) -> None:
+        self.filename: str = filename
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Method that opens the connection to the store and creates its tables if they do not exist yet
+
+        :return: conn
+        :rtype: sqlite3.Connection
+        """
+        if self.conn is None:
+            # autocommit mode: every statement is its own transaction unless BEGIN is issued explicitly
+            self.conn = sqlite3.connect(self.filename, timeout=30, isolation_level=None, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS conversations (
+                    chatId integer PRIMARY KEY NOT NULL,
+                    info text NOT NULL,
+                    updated real NOT NULL DEFAULT 0
+                )""")
+            if 'updated' not in [i_column[1] for i_column in self.conn.execute("PRAGMA table_info(conversations)")]:
+                # the store was created before the conversations could expire
+                self.conn.execute("ALTER TABLE conversations ADD COLUMN updated real NOT NULL DEFAULT 0")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS next_steps (
+                    stepId integer PRIMARY KEY AUTOINCREMENT NOT NULL,
+                    chatId integer NOT NULL,
+                    callback char NOT NULL,
+                    args text NOT NULL,
+                    kwargs text NOT NULL,
+                    created real NOT NULL DEFAULT 0
+                )""")
+            if 'created' not in [i_column[1] for i_column in self.conn.execute("PRAGMA table_info(next_steps)")]:
+                # the store was created before the next steps could expire, the existing ones are kept for max_age
+                self.conn.execute("ALTER TABLE next_steps ADD COLUMN created real NOT NULL DEFAULT 0")
+                self.conn.execute("UPDATE next_steps SET created=?", (time.time(),))
+            self.conn.execute("CREATE INDEX IF NOT EXISTS next_steps_chat ON next_steps (chatId)")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS cache (
+                    key char PRIMARY KEY NOT NULL,
+                    value text NOT NULL,
+                    expires real NOT NULL
+                )""")
+        return self.conn
+
+    def close(self) -> None:
+        """
+        Method that closes the connection to the store
+        :return: None
+        """
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def load_info(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Method that gets the criteria of the request the user is filling in
+
+        :param chat_id: Chat ID
+        :type chat_id: int
+        :return: info, or None if the user has no request in progress
+        :rtype: Optional[Dict[str, Any]]
+        """
+        with self.lock:
+            row: Optional[Tuple] = self.connect().execute(
+                "SELECT info FROM conversations WHERE chatId=?", (chat_id,)
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def save_info(self, chat_id: int, info: Dict[str, Any]) -> None:
+        """
+        Method that saves the criteria of the request the user is filling in
+
+        :param chat_id: Chat ID
+        :type chat_id: int
+        :param info: criteria of the request
+        :type info: Dict[str, Any]
+        :return: None
+        """
+        with self.lock:
+            self.connect().execute(
+                "INSERT OR REPLACE INTO conversations (chatId, info, updated) VALUES (?, ?, ?)",
+                (chat_id, json.dumps(info), time.time())
+            )
+
+    def clear_info(self, chat_id: int) -> None:
+        """
+        Method that removes the criteria of the request of the user
+
+        :param chat_id: Chat ID
+        :type chat_id: int
+        :return: None
+        """
+        with self.lock:
+            self.connect().execute("DELETE FROM conversations WHERE chatId=?", (chat_id,))
+
+    def push_handler(self, chat_id: int, callback: str, args: str, kwargs: str) -> None:
+        """
+        Method that saves a serialized next step handler of the chat
+
+        :param chat_id: Chat ID
+        :type chat_id: int
+        :param callback: dotted path of the callback function
+        :type callback: str
+        :param args: JSON encoded positional arguments of the callback
+        :type args: str
+        :param kwargs: JSON encoded keyword arguments of the callback
+        :type kwargs: str
+        :return: None
+        """
+        with self.lock:
+            self.connect().execute(
+                "INSERT INTO next_steps (chatId, callback, args, kwargs, created) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, callback, args, kwargs, time.time())
+            )
+
+    def pop_handlers(self, chat_id: int) -> List[Tuple[str, str, str]]:
+        """
+        Method that takes all next step handlers of the chat out of the store
+
+        :param chat_id: Chat ID
+        :type chat_id: int
+        :return: rows of (callback, args, kwargs)
+        :rtype: List[Tuple[str, str, str]]
+        """
+        with self.lock:
+            conn: sqlite3.Connection = self.connect()
+            # most messages have no next step, the read does not wait for the writers of other processes
+            if conn.execute("SELECT 1 FROM next_steps WHERE chatId=? LIMIT 1", (chat_id,)).fetchone() is None:
+                return list()
+            # the write lock is taken before the handlers are read again, so two processes can never
+            # run the same handler
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows: List[Tuple[str, str, str]] = conn.execute(
+                    "SELECT callback, args, kwargs FROM next_steps WHERE chatId=? ORDER BY stepId", (chat_id,)
+                ).fetchall()
+                conn.execute("DELETE FROM next_steps WHERE chatId=?", (chat_id,))
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def clear_handlers(self, chat_id: int) -> None:
+        """
+        Method that removes all next step handlers of the chat
+
+        :param chat_id: Chat ID
+        :type chat_id: int
+        :return: None
+        """
+        with self.lock:
+            self.connect().execute("DELETE FROM next_steps WHERE chatId=?", (chat_id,))
+
+    def get_cache(self, key: str) -> Optional[Any]:
+        """
+        Method that gets a value from the cache if it has not expired
+
+        :param key: cache key
+        :type key: str
+        :return: value
+        :rtype: Optional[Any]
+        """
+        with self.lock:
+            row: Optional[Tuple] = self.connect().execute(
+                "SELECT value FROM cache WHERE key=? AND expires>?", (key, time.time())
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set_cache(self, key: str, value: Any, ttl: float = 24 * 60 * 60) -> None:
+        """
+        Method that puts a value to the cache
+
+        :param key: cache key
+        :type key: str
+        :param value: JSON serializable value
+        :type value: Any
+        :param ttl: time to live of the value in seconds
+        :type ttl: float
+        :return: None
+        """
+        with self.lock:
+            self.connect().execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl)
+            )
+
+    def collect(self, max_age: float = 24 * 60 * 60) -> None:
+        """
+        Method that removes the expired cache values, the conversations abandoned for max_age seconds
+        together with their next step handlers, and the next step handlers waiting for max_age seconds
+
+        :param max_age: the time since the last change of an abandoned conversation in seconds
+        :type max_age: float
+        :return: None
+        """
+        with self.lock:
+            conn: sqlite3.Connection = self.connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM cache WHERE expires<=?", (time.time(),))
+                conn.execute(
+                    "DELETE FROM next_steps WHERE chatId IN (SELECT chatId FROM conversations WHERE updated<?)",
+                    (time.time() - max_age,)
+                )
+                conn.execute("DELETE FROM conversations WHERE updated<?", (time.time() - max_age,))
+                # the dialogs without the criteria of a request, like /cheapest, have no conversation
+                conn.execute("DELETE FROM next_steps WHERE created<?", (time.time() - max_age,))
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+
+
+class SharedHandlerBackend(HandlerBackend):
+    """
+    Backend of next step handlers that keeps them in the shared store instead of the process memory.
+    Callbacks are saved by their dotted path, the "bot" keyword argument is replaced
+    by the bot of the process that executes the handler
+
+    Args:
+        store (SharedStore): the shared store
+        bot: the bot the handlers are executed by
+    """
+    def __init__(self, store: SharedStore, bot=None) -> None:
+        super().__init__()
+        self.store: SharedStore = store
+        self.bot = bot
+
+    @staticmethod
+    def resolve(path: str) -> Callable:
+        """
+        Method that gets the function by its dotted path
+
+        :param path: dotted path of the function
+        :type path: str
+        :return: function
+        :rtype: Callable
+        """
+        module, name = path.rsplit('.', 1)
+        return getattr(importlib.import_module(module), name)
+
+    def register_handler(self, handler_group_id: int, handler: Handler) -> None:
+        kwargs: Dict[str, Any] = dict(handler.kwargs)
+        if 'bot' in kwargs:
+            kwargs['bot'] = None
+        self.store.push_handler(
+            handler_group_id, '{}.{}'.format(handler.callback.__module__, handler.callback.__qualname__),
+            json.dumps(handler.args), json.dumps(kwargs)
+        )
+
+    def clear_handlers(self, handler_group_id: int) -> None:
+        self.store.clear_handlers(handler_group_id)
+
+    def get_handlers(self, handler_group_id: int) -> Optional[List[Handler]]:
+        rows: List[Tuple[str, str, str]] = self.store.pop_handlers(handler_group_id)
+        if len(rows) == 0:
+            return None
+        handlers: List[Handler] = list()
+        for callback, args, kwargs in rows:
+            kwargs: Dict[str, Any] = json.loads(kwargs)
+            if 'bot' in kwargs:
+                kwargs['bot'] = self.bot
+            handlers.append(Handler(self.resolve(callback), *json.loads(args), **kwargs))
+        return handlers
@@ -0,0 +1,127 @@
+from typing import Any, Dict, List, Optional
+from shared_state import SharedStore
+from maintenance import Maintenance
+from main import Bot, register_handlers
+from telebot.types import Update
+from telebot import apihelper
+import multiprocessing
+import time
+
+
+def get_chat_id(update: Dict[str, Any]) -> int:
+    """
+    Function that finds the chat the update belongs to
+
+    :param update: Update received from Telegram
+    :type update: Dict[str, Any]
+    :return: chat_id, or 0 if the update has no chat
+    :rtype: int
+    """
+    for value in update.values():
+        if isinstance(value, dict):
+            chat: Optional[Dict[str, Any]] = value.get('chat') or value.get('message', {}).get('chat') or \
+                value.get('from')
+            if chat is not None:
+                return chat['id']
+    return 0
+
+
+def work(token: str, store_filename: str, queue: multiprocessing.Queue, template: Optional[str] = None,
+         started: Optional[float] = None) -> None:
+    """
+    Function processing the updates of the chats assigned to one worker.
+    The updates of a chat are handled one by one, in the order they were received
+
+    :param token: Bot token
+    :type token: str
+    :param store_filename: the filename of the shared store
+    :type store_filename: str
+    :param queue: queue of the worker's updates
+    :type queue: multiprocessing.Queue
+    :param template: Template of hotel cards and history
+    :type template: Optional[str]
+    :param started: the time.perf_counter() value at the start of the dispatcher, to report the time to ready
+    :type started: Optional[float]
+    :return: None
+    """
+    bot = Bot(token, store=SharedStore(store_filename), threaded=False, template=template)
+    register_handlers(bot)
+    bot.warm_up(started)
+    while True:
+        update: Optional[Dict[str, Any]] = queue.get()
+        if update is None:
+            # stop signal from the dispatcher
+            break
+        try:
+            bot.process_new_updates([Update.de_json(update)])
+        except Exception as exception:
+            print('The Exception occurred while processing the update {}: {}'.format(update['update_id'], exception))
+    bot.store.close()
+
+
+def run(token: str, workers: int, store_filename: str, started: Optional[float] = None,
+        template: Optional[str] = None) -> None:
+    """
+    Function that polls the updates and shards them by chat between worker processes
+
+    :param token: Bot token
+    :type token: str
+    :param workers: number of worker processes
+    :type workers: int
+    :param store_filename: the filename of the store shared by the workers
+    :type store_filename: str
+    :param started: the time.perf_counter() value at the start of the process, to report the time to ready
+    :type started: Optional[float]
+    :param template: Template of hotel cards and history
+    :type template: Optional[str]
+    :return: None
+    """
+    # creating the store's tables once, before the workers start using them
+    store = SharedStore(store_filename)
+    store.collect()
+    store.close()
+
+    queues: List[multiprocessing.Queue] = [multiprocessing.Queue() for _ in range(workers)]
+    processes: List[multiprocessing.Process] = [
+        multiprocessing.Process(target=work, args=(token, store_filename, queue, template, started), daemon=True)
+        for queue in queues
+    ]
+    for i_process in processes:
+        i_process.start()
+    # started after the workers, so no thread is running while they are forked
+    maintenance = Maintenance('history.db')
+    maintenance.start()
+    if started is not None:
+        # every worker reports the time to ready at the end of its warm-up
+        print('The bot is polling in {:.0f} ms'.format((time.perf_counter() - started) * 1000))
+
+    offset: Optional[int] = None
+    collected: float = time.monotonic()
+    try:
+        while True:
+            if time.monotonic() - collected > 60 * 60:
+                # the store is cleaned by the dispatcher only, the workers keep serving updates
+                try:
+                    store.collect()
+                except Exception as exception:
+                    print('The Exception occurred while cleaning the shared store: {}'.format(exception))
+                collected = time.monotonic()
+            try:
+                updates: List[Dict[str, Any]] = apihelper.get_updates(token, offset=offset, timeout=20,
+                                                                       long_polling_timeout=20)
+            except Exception as exception:
+                print('The Exception occurred while getting updates: {}'.format(exception))
+                time.sleep(1)
+                continue
+            for i_update in updates:
+                queues[get_chat_id(i_update) % workers].put(i_update)
+                offset = i_update['update_id'] + 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        maintenance.stop()
+        store.close()
+        for i_queue in queues:
+            i_queue.put(None)
+        for i_process in processes:
+            i_process.join()